@@ -1,49 +1,858 @@
 import os
 import sys
+import argparse
+import heapq
+import time
+import re
+import fnmatch
+import sqlite3
+import json
+import random
+import shutil
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import hashlib
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-def print_usage():
-    print("Usage: python list_files_by_size.py [folder_path] [filter_string]")
-    print("Lists all files in the folder (recursively), sorted by size.")
-    print("If no folder_path is provided, the current directory is used.")
-    print("Optional: filter_string will only show files containing that string (case-insensitive).")
+try:
+    import numpy as np
+except ImportError:
+    np = None  # --compact still works, the argsort is just slower and needs more memory
 
-def get_all_files(folder):
-    file_list = []
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+HASH_BLOCK = 64 * 1024
+
+def parse_size(text):
+    units = {"": 1, "B": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*", text, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size: {text}")
+    return int(float(match.group(1)) * units[match.group(2).upper()])
+
+class FileFilter:
+    # Predicates applied during the walk: names/paths are checked before any stat call,
+    # the size afterwards, and excluded directories are never descended into.
+    def __init__(self, substring=None, globs=(), regex=None, extensions=None, min_size=0, exclude=()):
+        self.substring = substring.lower() if substring else None
+        self.globs = list(globs)
+        self.regex = re.compile(regex) if regex else None
+        self.extensions = {"." + e.lower().lstrip(".") for e in extensions} if extensions else None
+        self.min_size = min_size
+        self.exclude_names = [p for p in exclude if "/" not in p and os.sep not in p]
+        self.exclude_paths = [p for p in exclude if "/" in p or os.sep in p]
+
+    def match_name(self, name, path):
+        if self.extensions is not None and os.path.splitext(name)[1].lower() not in self.extensions:
+            return False
+        if self.globs and not any(fnmatch.fnmatch(name, g) for g in self.globs):
+            return False
+        if self.substring and self.substring not in path.lower():
+            return False
+        if self.regex and not self.regex.search(path):
+            return False
+        return True
+
+    def match_size(self, size):
+        return size >= self.min_size
+
+    def exclude_dir(self, name, path):
+        return (any(fnmatch.fnmatch(name, p) for p in self.exclude_names)
+                or any(fnmatch.fnmatch(path, p) for p in self.exclude_paths))
+
+NO_FILTER = FileFilter()
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Lists all files in the folder (recursively), sorted by size."
+    )
+    parser.add_argument("folder", nargs="?", default=os.getcwd(),
+                        help="Folder to scan (default: current directory)")
+    parser.add_argument("filter_string", nargs="?", default=None,
+                        help="Only show files containing that string (case-insensitive)")
+    parser.add_argument("--glob", action="append", default=[],
+                        help="Only files whose name matches this glob, e.g. '*.mp4' (repeatable)")
+    parser.add_argument("--regex", default=None,
+                        help="Only files whose path matches this regular expression")
+    parser.add_argument("--ext", default=None,
+                        help="Only files with one of these comma-separated extensions, e.g. mp4,mkv")
+    parser.add_argument("--min-size", type=parse_size, default=0,
+                        help="Only files of at least this size, e.g. 500K, 100M, 2G")
+    parser.add_argument("--exclude", action="append", default=[],
+                        help="Skip directories whose name (or path, if the pattern has a separator) matches this glob (repeatable)")
+    parser.add_argument("--engine", choices=["scandir", "walk"], default="scandir",
+                        help="scandir: parallel os.scandir scanner (default), walk: old single-threaded os.walk")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"Threads used by the scandir engine (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--index", metavar="FILE", default=None,
+                        help="SQLite scan index: only directories whose mtime changed since the last run are listed again")
+    parser.add_argument("--rescan", action="store_true",
+                        help="With --index, ignore stored mtimes and list every directory again")
+    parser.add_argument("--offline", action="store_true",
+                        help="With --index, answer from the index alone without touching the filesystem")
+    parser.add_argument("--compact", action="store_true",
+                        help="Keep results in packed arrays instead of Python tuples (much less memory for huge scans)")
+    parser.add_argument("--dirs", action="store_true",
+                        help="List directories by recursive total size (du-style) instead of files")
+    parser.add_argument("--depth", type=int, default=None,
+                        help="With --dirs, only list directories up to this depth below the folder (totals still include everything)")
+    parser.add_argument("--dupes", action="store_true",
+                        help="List groups of duplicate files (same size, then same first/last block hash, then same full hash)")
+    parser.add_argument("--format", choices=["text", "jsonl", "csv", "tsv", "null"], default="text",
+                        help="Output format: text (default), jsonl, csv, tsv or null (tab between fields, NUL after each record). "
+                             "Machine formats print sizes in bytes and paths as their exact on-disk bytes")
+    parser.add_argument("--top", type=int, metavar="N", default=None,
+                        help="Only keep the N largest files (bounded heap, O(N) memory)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Print files while scanning (unsorted), with --top N print periodic snapshots of the current top N instead")
+    parser.add_argument("--interval", type=float, default=5.0,
+                        help="Seconds between --stream --top snapshots (default: 5)")
+
+    bench = parser.add_argument_group("benchmark")
+    bench.add_argument("--benchmark", action="store_true",
+                       help="Time all engines on a synthetic tree in a temp dir instead of scanning folder")
+    bench.add_argument("--bench-depth", type=int, default=3, help="Directory levels below the root (default: 3)")
+    bench.add_argument("--bench-fanout", type=int, default=8, help="Subdirectories per directory (default: 8)")
+    bench.add_argument("--bench-files", type=int, default=50, help="Files per directory (default: 50)")
+    bench.add_argument("--bench-sizes", choices=["fixed", "uniform", "lognormal"], default="lognormal",
+                       help="File size distribution, all average about 2 KiB per file, so about 60 MB for the "
+                            "default tree. Sparse on ext4/APFS, really written on NTFS (default: lognormal)")
+    bench.add_argument("--bench-repeat", type=int, default=3, help="Timed runs per engine, the best one counts (default: 3)")
+    bench.add_argument("--bench-output", default="benchmark.json", help="JSON results file (default: benchmark.json)")
+    return parser.parse_args()
+
+def walk_files(folder, file_filter=NO_FILTER):
+    # Old engine, kept for comparison: one os.walk plus one extra stat per file
     for root, dirs, files in os.walk(folder):
+        dirs[:] = [d for d in dirs if not file_filter.exclude_dir(d, os.path.join(root, d))]
         for name in files:
             filepath = os.path.join(root, name)
+            if not file_filter.match_name(name, filepath):
+                continue
             try:
                 size = os.path.getsize(filepath)
-                file_list.append((size, filepath))
             except Exception as e:
-                print(f"Could not access {filepath}: {e}")
-    return file_list
+                print(f"Could not access {filepath}: {e}", file=sys.stderr)
+                continue
+            if file_filter.match_size(size):
+                yield size, filepath
 
-def main():
-    # Handle --help
-    if "--help" in sys.argv or "-h" in sys.argv:
-        print_usage()
-        sys.exit(0)
+def scan_dir(path, file_filter=NO_FILTER):
+    # Lists one directory, returns its files as (size, path) and its subdirectories.
+    # DirEntry caches the type from the directory listing (and the stat on Windows),
+    # so there is no separate getsize/isdir round-trip per entry.
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        # Like os.walk, don't follow symlinked directories
+                        if not entry.is_symlink() and not file_filter.exclude_dir(entry.name, entry.path):
+                            subdirs.append(entry.path)
+                        continue
+                    if not file_filter.match_name(entry.name, entry.path):
+                        continue
+                    size = entry.stat().st_size
+                    if file_filter.match_size(size):
+                        files.append((size, entry.path))
+                except OSError as e:
+                    print(f"Could not access {entry.path}: {e}", file=sys.stderr)
+    except OSError as e:
+        print(f"Could not access {path}: {e}", file=sys.stderr)
+    return files, subdirs
 
-    # Determine folder and filter_string
-    folder = sys.argv[1] if len(sys.argv) > 1 else os.getcwd()
-    filter_string = sys.argv[2].lower() if len(sys.argv) > 2 else None
+def walk_tree(folder, scan, workers=DEFAULT_WORKERS, handle=None):
+    # Fans directories out over a bounded thread pool. scan(path) runs on the pool,
+    # handle(path, result) -> (files, subdirs) runs on the calling thread. At most
+    # 2*workers directories are in flight, the rest wait in a queue of paths,
+    # so memory stays O(pending dirs).
+    if handle is None:
+        handle = lambda path, result: result
+    if workers <= 1:
+        pending = deque([folder])
+        while pending:
+            path = pending.popleft()
+            files, subdirs = handle(path, scan(path))
+            pending.extend(subdirs)
+            yield from files
+        return
 
-    if not os.path.isdir(folder):
-        print(f"Error: {folder} is not a folder.")
-        print_usage()
+    pending = deque([folder])
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            while pending and len(running) < 2 * workers:
+                path = pending.popleft()
+                running[pool.submit(scan, path)] = path
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = handle(running.pop(future), future.result())
+                pending.extend(subdirs)
+                yield from files
+
+def scandir_files(folder, workers=DEFAULT_WORKERS, file_filter=NO_FILTER):
+    return walk_tree(folder, lambda path: scan_dir(path, file_filter), workers)
+
+class ScanIndex:
+    # SQLite index of a previous scan: one row per directory with its mtime, one per file
+    # with its size. Paths are stored as fsencoded blobs so undecodable names survive.
+    # A directory whose mtime is unchanged is served from the index instead of being
+    # listed again. Note that rewriting a file in place does not touch its directory's
+    # mtime, use --rescan to refresh everything.
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (id INTEGER PRIMARY KEY, path BLOB UNIQUE NOT NULL,
+                                             parent INTEGER, mtime_ns INTEGER);
+            CREATE TABLE IF NOT EXISTS files (dir INTEGER NOT NULL, name BLOB NOT NULL, size INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent);
+            CREATE INDEX IF NOT EXISTS files_dir ON files(dir);
+        """)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def dir_id(self, path, parent=None):
+        key = os.fsencode(path)
+        row = self.db.execute("SELECT id, parent FROM dirs WHERE path = ?", (key,)).fetchone()
+        if row:
+            # A directory first indexed as a scan root has no parent yet, adopt it
+            # once it is seen from above so cached() lists it under its parent
+            if parent is not None and row[1] != parent:
+                self.db.execute("UPDATE dirs SET parent = ? WHERE id = ?", (parent, row[0]))
+            return row[0]
+        return self.db.execute("INSERT INTO dirs (path, parent) VALUES (?, ?)", (key, parent)).lastrowid
+
+    def known_mtimes(self):
+        return {os.fsdecode(path): mtime for path, mtime in self.db.execute("SELECT path, mtime_ns FROM dirs")}
+
+    def cached(self, dir_id):
+        files = [(size, os.fsdecode(name)) for name, size in
+                 self.db.execute("SELECT name, size FROM files WHERE dir = ?", (dir_id,))]
+        subdirs = [os.fsdecode(p) for (p,) in self.db.execute("SELECT path FROM dirs WHERE parent = ?", (dir_id,))]
+        return files, subdirs
+
+    def update(self, dir_id, path, mtime, files, subdirs):
+        self.db.execute("UPDATE dirs SET mtime_ns = ? WHERE id = ?", (mtime, dir_id))
+        self.db.execute("DELETE FROM files WHERE dir = ?", (dir_id,))
+        self.db.executemany("INSERT INTO files (dir, name, size) VALUES (?, ?, ?)",
+                            ((dir_id, os.fsencode(name), size) for size, name in files))
+        keep = {os.fsencode(p) for p in subdirs}
+        for child_id, child_path in self.db.execute("SELECT id, path FROM dirs WHERE parent = ?", (dir_id,)).fetchall():
+            if child_path not in keep:
+                self.remove_tree(child_id)
+        for p in subdirs:
+            self.dir_id(p, dir_id)
+
+    def remove_tree(self, dir_id):
+        subtree = """WITH RECURSIVE sub(id) AS (SELECT ? UNION ALL
+                     SELECT dirs.id FROM dirs JOIN sub ON dirs.parent = sub.id)"""
+        self.db.execute(subtree + " DELETE FROM files WHERE dir IN sub", (dir_id,))
+        self.db.execute(subtree + " DELETE FROM dirs WHERE id IN sub", (dir_id,))
+
+def probe_dir(path, known_mtime):
+    # Runs on the pool: stat the directory and only list it if its mtime changed.
+    # Returns None on error, (mtime, None, None) if unchanged, else
+    # (mtime, [(size, name)], [subdir paths]) unfiltered, so the index serves any filter.
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError as e:
+        print(f"Could not access {path}: {e}", file=sys.stderr)
+        return None
+    if mtime == known_mtime:
+        return mtime, None, None
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                        continue
+                    files.append((entry.stat().st_size, entry.name))
+                except OSError as e:
+                    print(f"Could not access {entry.path}: {e}", file=sys.stderr)
+    except OSError as e:
+        print(f"Could not access {path}: {e}", file=sys.stderr)
+        return None
+    # Directories changed within the mtime granularity of the scan may change again
+    # unnoticed, store no mtime for them so the next run lists them again
+    if time.time_ns() - mtime < 2 * 10**9:
+        mtime = None
+    return mtime, files, subdirs
+
+def filter_listing(path, files, subdirs, file_filter):
+    files = [(size, os.path.join(path, name)) for size, name in files
+             if file_filter.match_size(size) and file_filter.match_name(name, os.path.join(path, name))]
+    subdirs = [d for d in subdirs if not file_filter.exclude_dir(os.path.basename(d), d)]
+    return files, subdirs
+
+def indexed_files(folder, index, workers=DEFAULT_WORKERS, file_filter=NO_FILTER, rescan=False):
+    # Like scandir_files, but unchanged directories come from the index
+    folder = os.path.abspath(folder)
+    known = {} if rescan else index.known_mtimes()
+    index.dir_id(folder)
+    updated = 0
+
+    def handle(path, result):
+        nonlocal updated
+        if result is None:
+            return [], []
+        mtime, files, subdirs = result
+        dir_id = index.dir_id(path)
+        if files is None:
+            files, subdirs = index.cached(dir_id)
+        else:
+            index.update(dir_id, path, mtime, files, subdirs)
+            updated += 1
+            if updated % 1000 == 0:
+                index.db.commit()
+        return filter_listing(path, files, subdirs, file_filter)
+
+    yield from walk_tree(folder, lambda path: probe_dir(path, known.get(path)), workers, handle)
+    index.db.commit()
+
+def offline_files(folder, index, file_filter=NO_FILTER):
+    # Answers from the index alone, without touching the filesystem
+    folder = os.path.abspath(folder)
+    row = index.db.execute("SELECT id FROM dirs WHERE path = ?", (os.fsencode(folder),)).fetchone()
+    if not row:
+        print(f"Error: {folder} is not in the index.")
         sys.exit(1)
+    return walk_tree(folder, lambda path: None, 1,
+                     lambda path, _: filter_listing(path, *index.cached(index.dir_id(path)), file_filter))
+
+def iter_files(folder, engine="scandir", workers=DEFAULT_WORKERS, file_filter=NO_FILTER, index=None, offline=False, rescan=False):
+    if index is not None:
+        if offline:
+            return offline_files(folder, index, file_filter)
+        return indexed_files(folder, index, workers, file_filter, rescan)
+    if engine == "walk":
+        return walk_files(folder, file_filter)
+    return scandir_files(folder, workers, file_filter)
+
+def get_all_files(folder, engine="scandir", workers=DEFAULT_WORKERS, file_filter=NO_FILTER, index=None, offline=False, rescan=False):
+    return list(iter_files(folder, engine, workers, file_filter, index, offline, rescan))
+
+class TopFiles:
+    # Min-heap of the n largest (size, path) seen so far, the smallest sits at heap[0]
+    def __init__(self, n):
+        self.n = n
+        self.heap = []
+
+    def add(self, item):
+        if len(self.heap) < self.n:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+
+    def sorted(self):
+        return sorted(self.heap)  # Sort by size, smallest first
+
+def top_files(files, n):
+    top = TopFiles(n)
+    for item in files:
+        top.add(item)
+    return top.sorted()
+
+def stream_top_files(files, n, interval):
+    # Yields the current top n whenever interval seconds have passed, and once at the end
+    # unless nothing was added since the last snapshot
+    top = TopFiles(n)
+    count = 0
+    snapshot_count = None
+    next_snapshot = time.monotonic() + interval
+    for item in files:
+        top.add(item)
+        count += 1
+        if time.monotonic() >= next_snapshot:
+            yield count, top.sorted()
+            snapshot_count = count
+            next_snapshot = time.monotonic() + interval
+    if count != snapshot_count:
+        yield count, top.sorted()
+
+class CompactFiles:
+    # Array-backed result store: sizes in an array('Q'), each path split into a directory id
+    # and a basename stored fsencoded in one bytes blob. Roughly 20 bytes + the name per file
+    # instead of a tuple, an int and a full path string.
+    def __init__(self):
+        self.sizes = array("Q")
+        self.dir_ids = array("I")
+        self.name_ends = array("Q")
+        self.names = bytearray()
+        self.dirs = []
+        self.dir_lookup = {}
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def add(self, size, path):
+        head, sep, name = path.rpartition(os.sep)
+        head += sep
+        dir_id = self.dir_lookup.get(head)
+        if dir_id is None:
+            dir_id = self.dir_lookup[head] = len(self.dirs)
+            self.dirs.append(head)
+        self.sizes.append(size)
+        self.dir_ids.append(dir_id)
+        self.names += os.fsencode(name)
+        self.name_ends.append(len(self.names))
 
-    files = get_all_files(folder)
-    files.sort()  # Sort by size, smallest first
+    def extend(self, files):
+        for size, path in files:
+            self.add(size, path)
 
+    def path(self, i):
+        start = self.name_ends[i - 1] if i else 0
+        return self.dirs[self.dir_ids[i]] + os.fsdecode(bytes(self.names[start:self.name_ends[i]]))
+
+    def argsort(self):
+        # Indices ordered by size, stable so equal sizes keep scan order until the tie-break
+        if np is not None:
+            order = array("Q")
+            order.frombytes(np.frombuffer(self.sizes, dtype=np.uint64).argsort(kind="stable").astype(np.uint64).tobytes())
+            return order
+        return sorted(range(len(self.sizes)), key=self.sizes.__getitem__)
+
+    def sorted(self):
+        # Same order as sorting (size, path) tuples: by size, equal sizes by path
+        sizes = self.sizes
+        order = self.argsort()
+        i = 0
+        while i < len(order):
+            size = sizes[order[i]]
+            j = i + 1
+            while j < len(order) and sizes[order[j]] == size:
+                j += 1
+            for path in sorted(self.path(k) for k in order[i:j]):
+                yield size, path
+            i = j
+
+def rollup_dirs(files, root, depth=None):
+    # du-style totals in the same pass as the scan: every file is added to its directory,
+    # cut off at depth, then each directory is added to its ancestors once at the end.
+    # Memory is O(directories up to depth), the files themselves are not kept.
+    prefix = len(root)
+    direct = {}
     for size, path in files:
-        if filter_string and filter_string not in path.lower():
-            continue
+        parts = path[prefix:].lstrip(os.sep).split(os.sep, depth if depth is not None else -1)
+        key = tuple(parts[:-1])
+        entry = direct.get(key)
+        if entry is None:
+            direct[key] = [size, 1]
+        else:
+            entry[0] += size
+            entry[1] += 1
+
+    totals = {}
+    for key, (size, count) in direct.items():
+        for i in range(len(key) + 1):
+            entry = totals.setdefault(key[:i], [0, 0])
+            entry[0] += size
+            entry[1] += count
+    return [(size, count, os.path.join(root, *key)) for key, (size, count) in totals.items()]
+
+def hash_file(path, size, partial):
+    # partial: only the first and last HASH_BLOCK bytes, enough to split most same-size files
+    h = hashlib.blake2b(digest_size=20)
+    try:
+        with open(path, "rb") as f:
+            if partial:
+                h.update(f.read(HASH_BLOCK))
+                if size > 2 * HASH_BLOCK:
+                    f.seek(size - HASH_BLOCK)
+                h.update(f.read(HASH_BLOCK))
+            else:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+    except OSError as e:
+        print(f"Could not access {path}: {e}", file=sys.stderr)
+        return None
+    return h.digest()
+
+def file_id(path):
+    # (st_dev, st_ino) to recognize hard links, the path itself where the filesystem
+    # reports no inode numbers, None if the file can't be accessed
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        print(f"Could not access {path}: {e}", file=sys.stderr)
+        return None
+    return (st.st_dev, st.st_ino) if st.st_ino else path
+
+def split_by_inode(groups, pool):
+    # groups: [(size, [paths])] -> same, with one path per inode: hard links share their
+    # data, so they are neither read twice nor counted as wasted space
+    jobs = [(size, path) for size, paths in groups for path in paths]
+    ids = pool.map(lambda job: file_id(job[1]), jobs)
+    buckets = {}
+    for (size, path), key in zip(jobs, ids):
+        if key is not None:
+            buckets.setdefault(size, {}).setdefault(key, path)
+    return [(size, list(paths.values())) for size, paths in buckets.items() if len(paths) > 1]
+
+def split_by_hash(groups, partial, pool):
+    # groups: [(size, [paths])] -> same, but split so every group shares a hash and has 2+ files
+    jobs = [(size, path) for size, paths in groups for path in paths]
+    digests = pool.map(lambda job: hash_file(job[1], job[0], partial), jobs)
+    buckets = {}
+    for (size, path), digest in zip(jobs, digests):
+        if digest is not None:
+            buckets.setdefault((size, digest), []).append(path)
+    return [(size, paths) for (size, _), paths in buckets.items() if len(paths) > 1]
+
+def find_duplicates(files, workers=DEFAULT_WORKERS):
+    # Staged so that only real candidates get read: group by size (free, from the scan),
+    # drop extra hard links to the same inode, then hash the first/last block, then fully
+    # hash whatever still collides. Each group lists one path per inode.
+    by_size = {}
+    for size, path in files:
+        if size:  # Empty files are all equal, nothing to gain
+            by_size.setdefault(size, []).append(path)
+    groups = [(size, paths) for size, paths in by_size.items() if len(paths) > 1]
+    del by_size
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        groups = split_by_inode(groups, pool)
+        groups = split_by_hash(groups, True, pool)
+        # Files up to two blocks were read completely by the partial hash already
+        small = [g for g in groups if g[0] <= 2 * HASH_BLOCK]
+        large = [g for g in groups if g[0] > 2 * HASH_BLOCK]
+        groups = small + split_by_hash(large, False, pool)
+
+    # Sort by wasted space, smallest first
+    groups.sort(key=lambda g: (g[0] * (len(g[1]) - 1), g[0]))
+    return [(size, sorted(paths)) for size, paths in groups]
+
+def format_file(size, path):
+    return f"{size/1024/1024:.2f} MB\t{path}"
+
+def format_dir(size, count, path):
+    return f"{size/1024/1024:.2f} MB\t{count} files\t{path}"
+
+class RecordWriter:
+    # Batches output instead of a print() per line. The machine formats go through one
+    # large buffered binary writer on stdout and write paths as their exact on-disk bytes
+    # (os.fsencode, surrogateescape). Text goes through sys.stdout in batches of lines: on
+    # a Windows console only its console writer shows non-ASCII names right, raw bytes on
+    # fd 1 would be read in the console code page. What the encoding can't show is replaced.
+    TEXT_BATCH = 4096
+
+    def __init__(self, fmt, fields, text, autoflush=False):
+        self.fmt = fmt
+        self.fields = fields
+        self.text = text
+        self.autoflush = autoflush
+        self.lines = []
+        if fmt != "text":
+            sys.stdout.flush()
+            self.out = open(sys.stdout.fileno(), "wb", buffering=1024 * 1024, closefd=False)
+        if fmt == "csv":
+            self.out.write(",".join(fields).encode() + b"\n")
+
+    def field(self, value):
+        return os.fsencode(value) if isinstance(value, str) else str(value).encode()
+
+    def write(self, *values):
+        if self.fmt == "text":
+            self.write_text(self.text(*values))
+            return
+        if self.fmt == "jsonl":
+            line = json.dumps(dict(zip(self.fields, values)), ensure_ascii=False).encode("utf-8", "surrogateescape") + b"\n"
+        elif self.fmt == "csv":
+            line = b",".join(b'"' + f.replace(b'"', b'""') + b'"' if isinstance(v, str) else f
+                             for v, f in zip(values, map(self.field, values))) + b"\n"
+        elif self.fmt == "tsv":
+            line = b"\t".join(map(self.field, values)) + b"\n"
+        else:
+            line = b"\t".join(map(self.field, values)) + b"\0"
+        self.out.write(line)
+        if self.autoflush:
+            self.out.flush()
+
+    def write_text(self, line):
+        self.lines.append(line)
+        if self.autoflush:
+            self.flush()
+        elif len(self.lines) >= self.TEXT_BATCH:
+            self.write_lines()
+
+    def write_lines(self):
+        if self.lines:
+            encoding = sys.stdout.encoding or "utf-8"
+            text = "\n".join(self.lines) + "\n"
+            sys.stdout.write(text.encode(encoding, errors="replace").decode(encoding))
+            self.lines = []
+
+    def comment(self, line):
+        # Headings only make sense for humans, the machine formats carry them as fields
+        if self.fmt == "text":
+            self.write_text(line)
+
+    def flush(self):
+        if self.fmt == "text":
+            self.write_lines()
+            sys.stdout.flush()
+        else:
+            self.out.flush()
+
+    def close(self):
+        self.flush()
+
+def report(args, root, files):
+    # Pipeline: scan (with filters applied during the walk) -> (top/sort) -> format
+    if args.dirs:
+        dirs = rollup_dirs(files, root, args.depth)
+        dirs.sort()  # Sort by size, smallest first
+        if args.top is not None:
+            dirs = dirs[-args.top:]
+        out = RecordWriter(args.format, ("size", "files", "path"), format_dir)
+        for size, count, path in dirs:
+            out.write(size, count, path)
+        out.close()
+        return
+
+    if args.dupes:
+        groups = find_duplicates(files, args.workers)
+        if args.top is not None:
+            groups = groups[-args.top:]
+        out = RecordWriter(args.format, ("group", "size", "path"), lambda group, size, path: format_file(size, path))
+        for group, (size, paths) in enumerate(groups):
+            out.comment(f"--- {len(paths)} copies, {size*(len(paths)-1)/1024/1024:.2f} MB wasted ---")
+            for path in paths:
+                out.write(group, size, path)
+        out.close()
+        return
+
+    if args.stream and args.top is not None:
+        out = RecordWriter(args.format, ("snapshot", "size", "path"), lambda snapshot, size, path: format_file(size, path))
+        for snapshot, (count, files) in enumerate(stream_top_files(files, args.top, args.interval)):
+            out.comment(f"--- top {len(files)} after {count} files ---")
+            for size, path in files:
+                out.write(snapshot, size, path)
+            out.flush()
+        out.close()
+        return
+
+    out = RecordWriter(args.format, ("size", "path"), format_file, autoflush=args.stream)
+    if not args.stream:
+        if args.top is not None:
+            files = top_files(files, args.top)
+        elif args.compact:
+            store = CompactFiles()
+            store.extend(files)
+            files = store.sorted()
+        else:
+            files = sorted(files)  # Sort by size, smallest first
+
+    for size, path in files:
+        out.write(size, path)
+    out.close()
+
+def make_tree(root, depth, fanout, files, sizes, rng, mtime):
+    # Synthetic tree for --benchmark, files are created via truncate. Sizes average about
+    # 2 KiB whatever the distribution: truncate only gives sparse files on filesystems
+    # that support it (ext4, APFS, ...), NTFS and others really allocate the space.
+    count = 0
+    for i in range(files):
+        if sizes == "fixed":
+            size = 2048
+        elif sizes == "uniform":
+            size = rng.randrange(0, 4096)
+        else:
+            size = min(int(rng.lognormvariate(6.5, 1.5)), 1024 * 1024)
+        with open(os.path.join(root, f"file{i:05}.bin"), "wb") as f:
+            f.truncate(size)
+        count += 1
+    if depth > 0:
+        for i in range(fanout):
+            sub = os.path.join(root, f"dir{i:03}")
+            os.mkdir(sub)
+            count += make_tree(sub, depth - 1, fanout, files, sizes, rng, mtime)
+    # Backdate, otherwise the index treats every directory as just modified
+    os.utime(root, (mtime, mtime))
+    return count
+
+def count_syscalls(argv):
+    # Total syscalls of a child process, needs strace (Linux only)
+    with tempfile.NamedTemporaryFile(suffix=".txt", delete=False) as f:
+        summary = f.name
+    try:
+        subprocess.run(["strace", "-f", "-c", "-o", summary] + argv,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        with open(summary) as f:
+            for line in f:
+                if line.strip().endswith("total"):
+                    # "100.00  0.001234  12  3456  78  total" -> calls is the 4th column
+                    return int(line.split()[3])
+    except (OSError, subprocess.CalledProcessError, ValueError, IndexError):
+        return None
+    finally:
+        os.remove(summary)
+    return None
+
+def benchmark_engine(name, tree, empty, tmp, engine, workers, index_mode, repeat, strace):
+    db = os.path.join(tmp, f"{name}.db")
+
+    def run():
+        index = None
+        if index_mode:
+            if index_mode == "cold" and os.path.exists(db):
+                os.remove(db)
+            index = ScanIndex(db)
         try:
-            print(f"{size/1024/1024:.2f} MB\t{path}")
-        except UnicodeEncodeError:
-            print(f"{size/1024/1024:.2f} MB\t{path.encode(sys.stdout.encoding, errors='replace').decode(sys.stdout.encoding)}")
+            return len(get_all_files(tree, engine, workers, index=index))
+        finally:
+            if index is not None:
+                index.close()
+
+    run()  # warm-up, also builds the index for the warm run
+    best = None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        found = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    syscalls = None
+    if strace:
+        def argv(folder, db_file):
+            options = ["--engine", engine, "--workers", str(workers)]
+            if index_mode:
+                options += ["--index", db_file]
+            # The pyinstaller build is its own interpreter
+            script = [] if getattr(sys, "frozen", False) else [os.path.abspath(__file__)]
+            return [sys.executable] + script + ["--format", "null"] + options + [folder]
+
+        if index_mode == "cold":
+            os.remove(db)
+        # Interpreter startup is measured on an empty folder and subtracted
+        calls = count_syscalls(argv(tree, db))
+        baseline = count_syscalls(argv(empty, os.path.join(tmp, f"{name}-empty.db")))
+        if calls is not None and baseline is not None and found:
+            syscalls = (calls - baseline) / found
+
+    return {
+        "engine": name,
+        "files": found,
+        "seconds": round(best, 4),
+        "files_per_sec": round(found / best) if best else None,
+        "peak_mb": round(peak / 1024 / 1024, 2),
+        "syscalls_per_file": round(syscalls, 2) if syscalls is not None else None,
+    }
+
+def benchmark(args):
+    rng = random.Random(1)
+    tmp = tempfile.mkdtemp(prefix="dir-largestFiles-bench-")
+    try:
+        tree = os.path.join(tmp, "tree")
+        empty = os.path.join(tmp, "empty")
+        os.mkdir(tree)
+        os.mkdir(empty)
+        print(f"Generating tree: depth {args.bench_depth}, fanout {args.bench_fanout}, "
+              f"{args.bench_files} files per dir, {args.bench_sizes} sizes")
+        total = make_tree(tree, args.bench_depth, args.bench_fanout, args.bench_files,
+                          args.bench_sizes, rng, time.time() - 3600)
+        print(f"{total} files")
+
+        strace = shutil.which("strace") is not None
+        if not strace:
+            print("strace not found, syscalls per file are not measured")
+        engines = [
+            # name, engine, workers, index mode
+            ("walk", "walk", 1, None),
+            ("scandir-1", "scandir", 1, None),
+            (f"scandir-{args.workers}", "scandir", args.workers, None),
+            ("index-cold", "scandir", args.workers, "cold"),
+            ("index-warm", "scandir", args.workers, "warm"),
+        ]
+        results = []
+        for name, engine, workers, index_mode in engines:
+            result = benchmark_engine(name, tree, empty, tmp, engine, workers, index_mode, args.bench_repeat, strace)
+            results.append(result)
+            print(f"{name:>12}: {result['seconds']:8.3f} s  {result['files_per_sec'] or 0:>10} files/s  "
+                  f"{result['peak_mb']:8.2f} MB peak  "
+                  f"{result['syscalls_per_file'] if result['syscalls_per_file'] is not None else 'n/a'} syscalls/file")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "numpy": np is not None,
+        "tree": {
+            "depth": args.bench_depth,
+            "fanout": args.bench_fanout,
+            "files_per_dir": args.bench_files,
+            "sizes": args.bench_sizes,
+            "files": total,
+        },
+        "repeat": args.bench_repeat,
+        "results": results,
+    }
+    with open(args.bench_output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.bench_output}")
+
+def main():
+    args = parse_args()
+    folder = args.folder
+
+    if args.benchmark:
+        benchmark(args)
+        return
+
+    if (args.offline or args.rescan) and not args.index:
+        print("Error: --offline and --rescan need --index.")
+        sys.exit(1)
+
+    if not args.offline and not os.path.isdir(folder):
+        print(f"Error: {folder} is not a folder.")
+        sys.exit(1)
+
+    if args.top is not None and args.top < 1:
+        print("Error: --top must be at least 1.")
+        sys.exit(1)
+
+    if args.depth is not None and args.depth < 0:
+        print("Error: --depth must not be negative.")
+        sys.exit(1)
+
+    try:
+        file_filter = FileFilter(
+            substring=args.filter_string,
+            globs=args.glob,
+            regex=args.regex,
+            extensions=args.ext.split(",") if args.ext else None,
+            min_size=args.min_size,
+            exclude=args.exclude,
+        )
+    except re.error as e:
+        print(f"Error: invalid --regex: {e}")
+        sys.exit(1)
+
+    index = ScanIndex(args.index) if args.index else None
+    try:
+        root = os.path.abspath(folder) if index is not None else folder
+        report(args, root, iter_files(folder, args.engine, args.workers, file_filter, index, args.offline, args.rescan))
+    finally:
+        if index is not None:
+            index.close()
 
 if __name__ == "__main__":
     main()
@@ -4,21 +4,15 @@ import io
 import sys
 import os
 import shutil
-
-def get_image_sizes(doc):
-    total_img_bytes = 0
-    img_info = []
-    for page_number in range(len(doc)):
-        page = doc[page_number]
-        for img in page.get_images(full=True):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            img_bytes = base_image["image"]
-            img_ext = base_image["ext"]
-            img_size = len(img_bytes)
-            total_img_bytes += img_size
-            img_info.append((page_number, xref, img_ext, img_size))
-    return total_img_bytes, img_info
+import argparse
+import multiprocessing
+import glob
+import json
+import time
+import hashlib
+import csv
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, Future, wait, as_completed, FIRST_COMPLETED
 
 def remove_images_from_pdf(input_pdf, output_pdf):
     doc = fitz.open(input_pdf)
@@ -39,80 +33,691 @@ def remove_images_from_pdf(input_pdf, output_pdf):
     doc.close()
 
 
-def compress_pdf_images(input_pdf, output_pdf, scale_factor=1.0, jpeg_quality=100):
-    doc = fitz.open(input_pdf)
-    processed_xrefs = set()
-    input_dir = os.path.dirname(os.path.abspath(input_pdf))
-    for page_number in range(len(doc)):
+TARGET_MIN_QUALITY = 30  # Below this JPEG artifacts get worse than losing resolution
+TARGET_MIN_SCALE = 0.1
+
+def open_image(img_bytes, scale_factor):
+    # Decode for a resize to scale_factor. JPEGs at scale 0.5 or below are decoded directly
+    # at 1/2, 1/4 or 1/8 resolution via draft(), never at full size. Returns the image and
+    # its full size, which the final resize is computed from.
+    img_pil = Image.open(io.BytesIO(img_bytes))
+    full_size = img_pil.size
+    scale = min(scale_factor, 1.0)
+    if img_pil.format == "JPEG" and scale <= 0.5:
+        img_pil.draft(img_pil.mode, (max(1, int(full_size[0] * scale)), max(1, int(full_size[1] * scale))))
+    return img_pil, full_size
+
+def resize_image(img_pil, full_size, scale_factor):
+    # High quality LANCZOS for the last step, reducing_gap lets Pillow box-reduce large
+    # downscales first instead of running LANCZOS over every source pixel
+    scale = min(scale_factor, 1.0)
+    new_size = (max(1, int(full_size[0] * scale)), max(1, int(full_size[1] * scale)))
+    img_resized = img_pil.resize(new_size, Image.LANCZOS, reducing_gap=3.0)
+    return img_resized.convert("RGB")
+
+def encode_jpeg(img_pil, jpeg_quality):
+    out = io.BytesIO()
+    img_pil.save(out, format="JPEG", quality=jpeg_quality)
+    return out.getvalue()
+
+def recompress_image(img_bytes, scale_factor, jpeg_quality):
+    # Runs in a worker process: decode, resize and JPEG-encode one image, return the JPEG bytes
+    # and the seconds spent per stage
+    start = time.perf_counter()
+    img_pil, full_size = open_image(img_bytes, scale_factor)
+    img_pil.load()
+    decoded = time.perf_counter()
+    img_resized = resize_image(img_pil, full_size, scale_factor)
+    resized = time.perf_counter()
+    # Always save as JPEG for maximum compression
+    new_bytes = encode_jpeg(img_resized, jpeg_quality)
+    times = {"decode": decoded - start, "resize": resized - decoded, "encode": time.perf_counter() - resized}
+    return new_bytes, times
+
+def fit_image(img_bytes, target_bytes, max_scale=1.0):
+    # Runs in a worker process: the best JPEG of at most target_bytes. Binary search over
+    # quality at max_scale first, if even TARGET_MIN_QUALITY is too big, binary search over
+    # scale at that quality. Decodes once (reduced, if max_scale allows), resized images and
+    # encodes are cached. Returns the JPEG bytes and the seconds spent per stage, summed
+    # over the whole search.
+    start = time.perf_counter()
+    img_pil, full_size = open_image(img_bytes, max_scale)
+    img_pil.load()
+    times = {"decode": time.perf_counter() - start, "resize": 0.0, "encode": 0.0}
+    resized = {}
+    encoded = {}
+
+    def encode(scale, quality):
+        if (scale, quality) not in encoded:
+            if scale not in resized:
+                start = time.perf_counter()
+                resized[scale] = resize_image(img_pil, full_size, scale)
+                times["resize"] += time.perf_counter() - start
+            start = time.perf_counter()
+            encoded[scale, quality] = encode_jpeg(resized[scale], quality)
+            times["encode"] += time.perf_counter() - start
+        return encoded[scale, quality]
+
+    max_scale = min(max_scale, 1.0)
+    if len(encode(max_scale, TARGET_MIN_QUALITY)) <= target_bytes:
+        low, high = TARGET_MIN_QUALITY, 95  # low always fits
+        while low < high:
+            mid = (low + high + 1) // 2
+            if len(encode(max_scale, mid)) <= target_bytes:
+                low = mid
+            else:
+                high = mid - 1
+        return encode(max_scale, low), times
+
+    low, high = TARGET_MIN_SCALE, max_scale  # high never fits
+    if len(encode(low, TARGET_MIN_QUALITY)) > target_bytes:
+        return encode(low, 10), times  # As small as it gets
+    for _ in range(8):
+        mid = round((low + high) / 2, 3)
+        if len(encode(mid, TARGET_MIN_QUALITY)) <= target_bytes:
+            low = mid
+        else:
+            high = mid
+    return encode(low, TARGET_MIN_QUALITY), times
+
+def allocate_image_budget(sizes, budget):
+    # sizes: xref -> current bytes. Splits budget in proportion to sqrt(size), so the biggest
+    # images get compressed hardest. Images already below their share keep their size and
+    # the rest is shared out again among the others.
+    # Empty streams (raw_stream_size gives 0 on errors) have nothing to share, and would
+    # leave no weight to divide by
+    targets = {xref: 0 for xref, size in sizes.items() if not size}
+    remaining = {xref: size for xref, size in sizes.items() if size}
+    while remaining:
+        weight = sum(size ** 0.5 for size in remaining.values())
+        fits = {xref: size for xref, size in remaining.items() if size <= budget * size ** 0.5 / weight}
+        if not fits:
+            break
+        for xref, size in fits.items():
+            targets[xref] = size
+            budget -= size
+            del remaining[xref]
+    for xref, size in remaining.items():
+        targets[xref] = max(1, int(budget * size ** 0.5 / weight))
+    return targets
+
+def parse_target_size(text, orig_size):
+    # "10M", "500K", "2000000" or a ratio of the input like "25%". Raises ValueError otherwise.
+    spec = text.strip().upper()
+    if spec.endswith("%"):
+        number, unit = spec[:-1], orig_size / 100
+    else:
+        units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+        spec = spec.rstrip("B")
+        if spec and spec[-1] in units:
+            number, unit = spec[:-1], units[spec[-1]]
+        else:
+            number, unit = spec, 1
+    try:
+        value = float(number)
+    except ValueError:
+        raise ValueError(f"invalid target size {text!r}, expected e.g. 10M, 500K, 2000000 or 25%") from None
+    if not 0 < value < float("inf"):
+        raise ValueError(f"invalid target size {text!r}, must be a positive number")
+    return int(value * unit)
+
+def target_size_spec(text):
+    # argparse type for --target-size, a percentage can only be resolved per input file
+    try:
+        parse_target_size(text, 0)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+class SerialExecutor:
+    # Stand-in for a one-worker ProcessPoolExecutor that runs in-process, used by batch workers
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+class ImageCache:
+    # Encoded results keyed on a hash of the image bytes plus the encode parameters, so logos
+    # and stamps stored under different xrefs (or in different PDFs) are encoded once.
+    # In-memory LRU bounded by max_bytes, optionally backed by a directory shared between runs.
+    def __init__(self, max_bytes=256 * 1024 * 1024, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(img_bytes, *params):
+        h = hashlib.blake2b(img_bytes, digest_size=20)
+        h.update(repr(params).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        data = self.entries.get(key)
+        if data is not None:
+            self.entries.move_to_end(key)
+        elif self.cache_dir:
+            try:
+                with open(os.path.join(self.cache_dir, key), "rb") as f:
+                    data = f.read()
+                self._remember(key, data)
+            except OSError:
+                pass
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        self._remember(key, data)
+        if self.cache_dir:
+            # Batch workers may write the same entry at once, replace is atomic
+            path = os.path.join(self.cache_dir, key)
+            temp = f"{path}.{os.getpid()}.tmp"
+            with open(temp, "wb") as f:
+                f.write(data)
+            os.replace(temp, path)
+
+    def _remember(self, key, data):
+        if key in self.entries:
+            return
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes and self.entries:
+            _, old = self.entries.popitem(last=False)
+            self.size -= len(old)
+
+def iter_image_xrefs(doc, page_numbers=None, processed_xrefs=None, seen_on=None):
+    # Every image xref once, with the first page it appears on and its get_images entry.
+    # seen_on (xref -> [page numbers]) collects every page an xref appears on.
+    processed_xrefs = set() if processed_xrefs is None else processed_xrefs
+    for page_number in (range(len(doc)) if page_numbers is None else page_numbers):
         page = doc[page_number]
-        images = page.get_images(full=True)
-        for img in images:
+        for img in page.get_images(full=True):
             xref = img[0]
+            if seen_on is not None:
+                pages = seen_on.setdefault(xref, [])
+                if page_number not in pages:
+                    pages.append(page_number)
             if xref in processed_xrefs:
                 continue
             processed_xrefs.add(xref)
-            base_image = doc.extract_image(xref)
-            img_bytes = base_image["image"]
-            img_pil = Image.open(io.BytesIO(img_bytes))
-            scale = min(scale_factor, 1.0)
-            new_size = (max(1, int(img_pil.width * scale)), max(1, int(img_pil.height * scale)))
-            img_resized = img_pil.resize(new_size, Image.LANCZOS)
-            # Always save as JPEG for maximum compression
-            temp_filename = os.path.join(input_dir, f"__tmp_img_{os.getpid()}_{xref}.jpg")
-            img_resized = img_resized.convert("RGB")
-            img_resized.save(temp_filename, format="JPEG", quality=jpeg_quality)
-            new_size_bytes = os.path.getsize(temp_filename)
-            orig_size = len(img_bytes)
-            # Only replace if new image is smaller
-            if new_size_bytes < orig_size:
-                page.replace_image(xref, filename=temp_filename)
-            else:
-                print(f"Warning: Recompressed image (xref {xref}) is larger ({new_size_bytes/1024:.1f} KB) than original ({orig_size/1024:.1f} KB). Keeping original.")
-            os.remove(temp_filename)
-    # Save with garbage collection and deflate
-    doc.save(output_pdf, garbage=4, deflate=True)
+            yield page_number, img
+
+def raw_stream_size(doc, xref):
+    # Bytes the (still encoded) image stream takes up in the file
+    try:
+        return len(doc.xref_stream_raw(xref) or b"")
+    except Exception:
+        return 0
+
+def image_stream_bytes(input_pdf):
+    # Stored size of every image stream in the document, soft masks included
+    doc = fitz.open(input_pdf)
+    total = sum(raw_stream_size(doc, img[0]) + (raw_stream_size(doc, img[1]) if img[1] else 0)
+                for _, img in iter_image_xrefs(doc))
+    doc.close()
+    return total
+
+BILEVEL_FILTERS = ("JBIG2Decode", "CCITTFaxDecode")
+SIZE_SKIPS = ("tiny", "lean jpeg")  # skip_reason results that --target-size overrides
+FILTER_EXTS = {"DCTDecode": "jpeg", "JPXDecode": "jpx", "JBIG2Decode": "jb2", "CCITTFaxDecode": "fax"}
+
+def parse_page_selection(text, page_count):
+    # "1-10,20,30-" (1-based, open ranges run to the end) -> sorted 0-based page numbers.
+    # Raises ValueError for anything else, including reversed ranges like "10-5".
+    pages = set()
+    parts = [part.strip() for part in text.split(",") if part.strip()]
+    if not parts:
+        raise ValueError(f"no pages in selection {text!r}")
+    for part in parts:
+        first, sep, last = part.partition("-")
+        try:
+            first = int(first) if first else 1
+            last = int(last) if last else None
+        except ValueError:
+            raise ValueError(f"invalid page range {part!r}, expected N, N-M, N- or -M") from None
+        if first < 1 or (last is not None and last < 1):
+            raise ValueError(f"invalid page range {part!r}, pages start at 1")
+        if last is not None and last < first:
+            raise ValueError(f"reversed page range {part!r}")
+        if not sep:
+            last = first
+        pages.update(range(first - 1, min(last or page_count, page_count)))
+    return sorted(pages)
+
+def page_selection(text):
+    # argparse type for --pages, only the syntax can be checked before a document is open
+    try:
+        parse_page_selection(text, 0)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+def skip_reason(img, raw_size, scale_factor, skip_below, skip_jpeg_bpp):
+    # Cheap checks on the get_images entry and the stored size, before anything is decoded.
+    # Returns why the image can't usefully shrink, or None.
+    width, height, bpc, img_filter = img[2], img[3], img[4], img[8]
+    if img_filter in BILEVEL_FILTERS:
+        return "bilevel codec"
+    if bpc == 1:
+        return "1-bit"
+    if skip_below and raw_size < skip_below:
+        return "tiny"
+    if skip_jpeg_bpp and img_filter == "DCTDecode" and width and height:
+        # Bits per pixel of the output size, a JPEG that is already this lean won't get smaller
+        out_pixels = width * height * min(scale_factor, 1.0) ** 2
+        if raw_size * 8 / out_pixels < skip_jpeg_bpp:
+            return "lean jpeg"
+    return None
+
+def compress_pdf_images(input_pdf, output_pdf, scale_factor=1.0, jpeg_quality=100, workers=None, cache=None, target_size=None,
+                        skip_below=8 * 1024, skip_jpeg_bpp=1.0, pages=None, chunk_pages=None, timings=None):
+    # Extraction and page.replace_image stay serial on the document, decode/resize/encode
+    # runs on a process pool. At most 2*workers images are in flight to bound memory.
+    # The same walk collects the analysis, one dict per image xref (see below), raw_bytes
+    # including the soft mask stream.
+    # With target_size (bytes) every image gets its own budget and fit_image searches
+    # scale/quality per image instead of using scale_factor/jpeg_quality as is.
+    # pages ("1-10,20") limits which pages are processed. With chunk_pages the output is a
+    # copy of the input that is updated chunk_pages pages at a time with incremental saves,
+    # reopening the document in between, so replaced images don't pile up in memory.
+    # timings, if given, gets the seconds spent extracting, saving and in total.
+    started = time.perf_counter()
+    timings = timings if timings is not None else {}
+    timings.update(extract=0.0, save=0.0)
+    doc = fitz.open(input_pdf)
+    page_numbers = parse_page_selection(pages, len(doc)) if pages else list(range(len(doc)))
+    workers = workers or os.cpu_count() or 1
+    cache = cache if cache is not None else ImageCache()
+    targets = None
+    if target_size is not None:
+        sizes = {img[0]: raw_stream_size(doc, img[0]) for _, img in iter_image_xrefs(doc, page_numbers)}
+        overhead = max(0, os.path.getsize(input_pdf) - sum(sizes.values()))
+        if target_size <= overhead:
+            print(f"Warning: Target size is below the size without images (~{overhead/1024/1024:.2f} MB), compressing images as far as possible.")
+        targets = allocate_image_budget(sizes, max(len(sizes), target_size - overhead))
+    if chunk_pages and not doc.can_save_incrementally():
+        print("Warning: PDF can't be saved incrementally, processing it in one go.")
+        chunk_pages = None
+    img_info = []
+    processed_xrefs = set()
+    seen_on = {}
+
+    def replace(doc, info, new_bytes, times=None):
+        if times is None:
+            info["cached"] = True
+        else:
+            info.update(decode_s=times["decode"], resize_s=times["resize"], encode_s=times["encode"])
+        page = doc[info["page"]]
+        new_size_bytes = len(new_bytes)
+        orig_size = info["bytes"]
+        # Only replace if new image is smaller
+        if new_size_bytes < orig_size:
+            page.replace_image(info["xref"], stream=new_bytes)
+            info["status"] = "replaced"
+            info["new_bytes"] = new_size_bytes
+        else:
+            info["status"] = "kept: larger"
+            print(f"Warning: Recompressed image (xref {info['xref']}) is larger ({new_size_bytes/1024:.1f} KB) than original ({orig_size/1024:.1f} KB). Keeping original.")
+
+    def process(doc, chunk, pool):
+        pending = iter_image_xrefs(doc, chunk, processed_xrefs, seen_on)
+        running = {}
+        waiting = {}  # cache key -> images waiting for the encode already in flight
+        while True:
+            for page_number, img in pending:
+                xref, smask = img[0], img[1]
+                extract_start = time.perf_counter()
+                raw_size = raw_stream_size(doc, xref) + (raw_stream_size(doc, smask) if smask else 0)
+                info = {"page": page_number, "pages": seen_on[xref], "xref": xref, "ext": FILTER_EXTS.get(img[8], "raw"),
+                        "bytes": raw_size, "raw_bytes": raw_size, "new_bytes": raw_size, "status": "kept", "cached": False,
+                        "extract_s": 0.0, "decode_s": 0.0, "resize_s": 0.0, "encode_s": 0.0}
+                img_info.append(info)
+                reason = skip_reason(img, raw_size, scale_factor, skip_below, skip_jpeg_bpp)
+                if targets is not None:
+                    # The budget counts every image as shrinkable, so the size heuristics
+                    # only hold for images that fit their share anyway
+                    if reason in SIZE_SKIPS and raw_size > targets[xref]:
+                        reason = None
+                    if reason is None and targets[xref] >= raw_size:
+                        reason = "within budget"
+                if reason is not None:
+                    info["status"] = f"skipped: {reason}"
+                    info["extract_s"] = time.perf_counter() - extract_start
+                    timings["extract"] += info["extract_s"]
+                    continue
+                base_image = doc.extract_image(xref)
+                img_bytes = base_image["image"]
+                info.update(ext=base_image["ext"], bytes=len(img_bytes), new_bytes=len(img_bytes),
+                            extract_s=time.perf_counter() - extract_start)
+                timings["extract"] += info["extract_s"]
+                if targets is not None:
+                    job = (fit_image, img_bytes, targets[xref], scale_factor)
+                else:
+                    job = (recompress_image, img_bytes, scale_factor, jpeg_quality)
+                key = cache.key(img_bytes, job[0].__name__, *job[2:])
+                if key in waiting:
+                    cache.hits += 1
+                    waiting[key].append(info)
+                    continue
+                new_bytes = cache.get(key)
+                if new_bytes is not None:
+                    replace(doc, info, new_bytes)
+                    continue
+                future = pool.submit(*job)
+                running[future] = key
+                waiting[key] = [info]
+                if len(running) >= 2 * workers:
+                    break
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                new_bytes, times = future.result()
+                cache.put(key, new_bytes)
+                first, *others = waiting.pop(key)
+                replace(doc, first, new_bytes, times)
+                for info in others:
+                    replace(doc, info, new_bytes)
+
+    with (ProcessPoolExecutor(max_workers=workers) if workers > 1 else SerialExecutor()) as pool:
+        if not chunk_pages:
+            process(doc, page_numbers, pool)
+            # Save with garbage collection and deflate
+            save_start = time.perf_counter()
+            doc.save(output_pdf, garbage=4, deflate=True)
+            doc.close()
+            timings["save"] += time.perf_counter() - save_start
+            timings["total"] = time.perf_counter() - started
+            return img_info
+
+        doc.close()
+        shutil.copyfile(input_pdf, output_pdf)
+        for start in range(0, len(page_numbers), chunk_pages):
+            doc = fitz.open(output_pdf)
+            process(doc, page_numbers[start:start + chunk_pages], pool)
+            save_start = time.perf_counter()
+            doc.saveIncr()
+            doc.close()
+            timings["save"] += time.perf_counter() - save_start
+            fitz.TOOLS.store_shrink(100)  # MuPDF keeps decoded objects cached past close()
+
+    # The incremental saves only appended, one full save drops the replaced streams
+    temp_pdf = f"{output_pdf}.{os.getpid()}.tmp"
+    save_start = time.perf_counter()
+    doc = fitz.open(output_pdf)
+    doc.save(temp_pdf, garbage=4, deflate=True)
     doc.close()
+    fitz.TOOLS.store_shrink(100)
+    os.replace(temp_pdf, output_pdf)
+    timings["save"] += time.perf_counter() - save_start
+    timings["total"] = time.perf_counter() - started
+    return img_info
+
+REPORT_FIELDS = ["xref", "pages", "ext", "bytes", "raw_bytes", "new_bytes", "status", "cached",
+                 "extract_s", "decode_s", "resize_s", "encode_s"]
+
+def summarize_images(img_info, timings):
+    total_bytes = sum(info["bytes"] for info in img_info)
+    total = timings.get("total") or 0.0
+    summary = {
+        "images": len(img_info),
+        "replaced": sum(info["status"] == "replaced" for info in img_info),
+        "skipped": sum(info["status"].startswith("skipped") for info in img_info),
+        "cached": sum(info["cached"] for info in img_info),
+        "image_bytes": total_bytes,
+        "new_image_bytes": sum(info["new_bytes"] for info in img_info),
+        "total_s": total,
+        "extract_s": timings.get("extract", 0.0),
+        "save_s": timings.get("save", 0.0),
+        # Worker stages are CPU seconds summed over all processes, not wall time
+        "decode_s": sum(info["decode_s"] for info in img_info),
+        "resize_s": sum(info["resize_s"] for info in img_info),
+        "encode_s": sum(info["encode_s"] for info in img_info),
+        "mb_per_s": total_bytes / 1024 / 1024 / total if total else None,
+        "images_per_s": len(img_info) / total if total else None,
+    }
+    return summary
+
+def write_report(report_path, img_info, summary):
+    # .csv: one row per image xref, anything else: JSON with the summary and the images.
+    # Pages are 1-based like everywhere else the user sees them.
+    rows = [dict({field: info[field] for field in REPORT_FIELDS}, pages=[p + 1 for p in info["pages"]]) for info in img_info]
+    if report_path.lower().endswith(".csv"):
+        with open(report_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(dict(row, pages=" ".join(map(str, row["pages"]))))
+    else:
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "images": rows}, f, indent=2)
+
+def find_batch_inputs(input_spec, exclude_dir=None):
+    # A directory (all PDFs below it) or a glob, returns the base directory and the PDFs.
+    # PDFs below exclude_dir are left out, so an output dir inside the input tree isn't
+    # compressed again (one level deeper) on the next run.
+    if os.path.isdir(input_spec):
+        base = input_spec
+        pattern = os.path.join(glob.escape(input_spec), "**", "*")
+    else:
+        magic = min((i for i, c in enumerate(input_spec) if c in "*?["), default=len(input_spec))
+        base = os.path.dirname(input_spec[:magic]) or "."
+        pattern = input_spec
+    inputs = [p for p in glob.glob(pattern, recursive=True)
+              if p.lower().endswith(".pdf") and os.path.isfile(p)]
+    if exclude_dir:
+        excluded = os.path.normcase(os.path.abspath(exclude_dir)) + os.sep
+        inputs = [p for p in inputs if not os.path.normcase(os.path.abspath(p)).startswith(excluded)]
+    return base, sorted(inputs)
+
+def read_journal(journal_path):
+    # Last entry per input wins
+    entries = {}
+    if os.path.exists(journal_path):
+        with open(journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Line cut off by an interrupted run
+                entries[entry["input"]] = entry
+    return entries
+
+def is_up_to_date(input_pdf, output_pdf, entry):
+    if not os.path.exists(output_pdf):
+        return False
+    in_stat = os.stat(input_pdf)
+    if entry and entry.get("status") == "done":
+        return (entry["input_size"] == in_stat.st_size and entry["input_mtime"] == in_stat.st_mtime
+                and entry["output_size"] == os.path.getsize(output_pdf))
+    return os.path.getmtime(output_pdf) >= in_stat.st_mtime
+
+worker_cache = None  # Per batch worker process, lives across the PDFs it handles
+
+def compress_file(input_pdf, output_pdf, options, cache_dir=None, cache_size=256):
+    # Runs in a batch worker process: one whole PDF, images recompressed in-process.
+    # Written to a .part file first so an interrupted run never leaves a complete-looking output.
+    global worker_cache
+    if worker_cache is None:
+        worker_cache = ImageCache(cache_size * 1024 * 1024, cache_dir)
+    if options.get("target_size"):
+        options = dict(options, target_size=parse_target_size(options["target_size"], os.path.getsize(input_pdf)))
+    os.makedirs(os.path.dirname(os.path.abspath(output_pdf)), exist_ok=True)
+    temp_pdf = output_pdf + ".part"
+    try:
+        compress_pdf_images(input_pdf, temp_pdf, workers=1, cache=worker_cache, **options)
+        os.replace(temp_pdf, output_pdf)
+    finally:
+        if os.path.exists(temp_pdf):
+            os.remove(temp_pdf)
+    return os.path.getsize(output_pdf)
 
-def main(input_pdf, output_pdf, scale_factor=1.0, jpeg_quality=100):
+def batch_compress(input_spec, output_dir, workers=None, journal_path=None, cache_dir=None, cache_size=256, **options):
+    # options are passed on to compress_pdf_images for every file. Returns the number of
+    # files that failed.
+    base, inputs = find_batch_inputs(input_spec, output_dir)
+    journal_path = journal_path or os.path.join(output_dir, ".pdf-compress-journal.jsonl")
+    os.makedirs(output_dir, exist_ok=True)
+    journal = read_journal(journal_path)
+
+    jobs = []
+    skipped = 0
+    for input_pdf in inputs:
+        rel = os.path.relpath(input_pdf, base)
+        output_pdf = os.path.join(output_dir, rel)
+        if is_up_to_date(input_pdf, output_pdf, journal.get(rel)):
+            skipped += 1
+            continue
+        jobs.append((rel, input_pdf, output_pdf))
+    print(f"Batch: {len(inputs)} PDFs, {skipped} up to date, {len(jobs)} to compress")
+
+    failed = 0
+    start = time.time()
+    with open(journal_path, "a", encoding="utf-8") as journal_file, \
+            ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        futures = {pool.submit(compress_file, input_pdf, output_pdf, options, cache_dir, cache_size): (rel, input_pdf)
+                   for rel, input_pdf, output_pdf in jobs}
+        for n, future in enumerate(as_completed(futures), 1):
+            rel, input_pdf = futures[future]
+            in_stat = os.stat(input_pdf)
+            entry = {"input": rel, "input_size": in_stat.st_size, "input_mtime": in_stat.st_mtime}
+            try:
+                output_size = future.result()
+                entry.update(status="done", output_size=output_size)
+                print(f"[{n}/{len(jobs)}] {rel}: {in_stat.st_size/1024/1024:.2f} MB -> {output_size/1024/1024:.2f} MB")
+            except Exception as e:
+                failed += 1
+                entry.update(status="failed", error=str(e))
+                print(f"[{n}/{len(jobs)}] {rel}: failed: {e}")
+            journal_file.write(json.dumps(entry) + "\n")
+            journal_file.flush()
+    print(f"Batch done in {time.time() - start:.1f} s, {failed} failed")
+    return failed
+
+def main(input_pdf, output_pdf, scale_factor=1.0, jpeg_quality=100, workers=None, exact_report=False,
+         cache_dir=None, cache_size=256, target_size=None, skip_below=8 * 1024, skip_jpeg_bpp=1.0, pages=None, chunk_pages=None,
+         report_path=None):
     print(f"Analyzing PDF: {input_pdf}")
     orig_pdf_size = os.path.getsize(input_pdf)
     print(f"Original PDF size: {orig_pdf_size/1024/1024:.2f} MB")
+    target_bytes = parse_target_size(target_size, orig_pdf_size) if target_size else None
+    if target_bytes is not None:
+        print(f"Target size: {target_bytes/1024/1024:.2f} MB, max scale factor: {scale_factor}")
+    else:
+        print(f"Using scale factor: {scale_factor}")
+        print(f"Using JPEG quality: {jpeg_quality}")
 
-    # 1. Calculate total image size in PDF
-    doc = fitz.open(input_pdf)
-    total_img_bytes, img_info = get_image_sizes(doc)
-    print(f"Total images in PDF: {len(img_info)}")
-    print(f"Total image data size: {total_img_bytes/1024/1024:.2f} MB ({100*total_img_bytes/orig_pdf_size:.2f}% of PDF)")
-    doc.close()
+    # 1. Analyze and compress images in one pass, save new PDF
+    cache = ImageCache(cache_size * 1024 * 1024, cache_dir)
+    timings = {}
+    img_info = compress_pdf_images(input_pdf, output_pdf, scale_factor=scale_factor, jpeg_quality=jpeg_quality, workers=workers,
+                                   cache=cache, target_size=target_bytes, skip_below=skip_below, skip_jpeg_bpp=skip_jpeg_bpp,
+                                   pages=pages, chunk_pages=chunk_pages, timings=timings)
+    if cache.hits:
+        print(f"Image cache hits: {cache.hits} of {cache.hits + cache.misses} encodes")
+    skipped = {}
+    for info in img_info:
+        if info["status"].startswith("skipped: "):
+            reason = info["status"][len("skipped: "):]
+            skipped[reason] = skipped.get(reason, 0) + 1
+    if skipped:
+        print(f"Skipped without decoding: {sum(skipped.values())} images ({', '.join(f'{n} {r}' for r, n in sorted(skipped.items()))})")
 
-    # 2. Calculate PDF size without images
-    temp_noimg_pdf = os.path.join(os.path.dirname(output_pdf), f"__tmp_noimg_{os.getpid()}.pdf")
-    remove_images_from_pdf(input_pdf, temp_noimg_pdf)
-    noimg_pdf_size = os.path.getsize(temp_noimg_pdf)
-    print(f"PDF size without images: {noimg_pdf_size/1024/1024:.2f} MB ({100*noimg_pdf_size/orig_pdf_size:.2f}% of PDF)")
+    # 2. Total image size in PDF, with --pages only the images on the selected pages
+    total_img_bytes = sum(info["bytes"] for info in img_info)
+    where = "on selected pages" if pages else "in PDF"
+    print(f"Total images {where}: {len(img_info)}")
+    print(f"Total image data size {where}: {total_img_bytes/1024/1024:.2f} MB ({100*total_img_bytes/orig_pdf_size:.2f}% of PDF)")
 
-    # 3. Print per-image info (before compression)
-    #print("Image breakdown (before compression):")
-    #for page_number, xref, img_ext, img_size in img_info:
-    #    print(f" - Page {page_number+1}, xref {xref}, {img_ext.upper()}, {img_size/1024:.1f} KB")
+    # 3. PDF size without images, estimated from the image stream lengths unless an exact
+    # (extra open and garbage=4 save) report was requested. Both cover the whole document.
+    if exact_report:
+        temp_noimg_pdf = os.path.join(os.path.dirname(os.path.abspath(output_pdf)), f"__tmp_noimg_{os.getpid()}.pdf")
+        remove_images_from_pdf(input_pdf, temp_noimg_pdf)
+        noimg_pdf_size = os.path.getsize(temp_noimg_pdf)
+        os.remove(temp_noimg_pdf)
+        print(f"PDF size without images: {noimg_pdf_size/1024/1024:.2f} MB ({100*noimg_pdf_size/orig_pdf_size:.2f}% of PDF)")
+    else:
+        # img_info only has the selected pages, the rest are still images, not overhead
+        all_img_bytes = image_stream_bytes(input_pdf) if pages else sum(info["raw_bytes"] for info in img_info)
+        noimg_pdf_size = max(0, orig_pdf_size - all_img_bytes)
+        print(f"PDF size without images (estimated): {noimg_pdf_size/1024/1024:.2f} MB ({100*noimg_pdf_size/orig_pdf_size:.2f}% of PDF)")
 
-    print(f"Using scale factor: {scale_factor}")
-    print(f"Using JPEG quality: {jpeg_quality}")
+    # 4. Timing breakdown, per-image info goes to the report
+    summary = summarize_images(img_info, timings)
+    print(f"Time: {summary['total_s']:.2f} s total, {summary['extract_s']:.2f} s extract, {summary['save_s']:.2f} s save "
+          f"(worker CPU: {summary['decode_s']:.2f} s decode, {summary['resize_s']:.2f} s resize, {summary['encode_s']:.2f} s encode)")
+    if summary["total_s"]:
+        print(f"Throughput: {summary['mb_per_s']:.2f} MB/s, {summary['images_per_s']:.1f} images/s")
+    if report_path:
+        write_report(report_path, img_info, summary)
+        print(f"Image report written to {report_path}")
 
-    # 4. Compress images and save new PDF
-    compress_pdf_images(input_pdf, output_pdf, scale_factor=scale_factor, jpeg_quality=jpeg_quality)
     final_pdf_size = os.path.getsize(output_pdf)
     print(f"Final PDF size: {final_pdf_size/1024/1024:.2f} MB")
-
-    # Cleanup
-    os.remove(temp_noimg_pdf)
+    if target_bytes is not None and final_pdf_size > target_bytes:
+        print(f"Warning: Missed the target size by {(final_pdf_size - target_bytes)/1024:.1f} KB.")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python pdf-compress.py input.pdf output.pdf [scale_factor]")
+    multiprocessing.freeze_support()  # Worker processes of the pyinstaller build
+    parser = argparse.ArgumentParser(description="Compresses and scales images in a PDF to reduce its size.")
+    parser.add_argument("input_pdf", help="Input PDF, with --batch a directory or glob")
+    parser.add_argument("output_pdf", help="Output PDF, with --batch the output directory")
+    parser.add_argument("scale_factor", nargs="?", type=float, default=1.0,
+                        help="Image scale factor, also sets the JPEG quality to 100*scale (default: 1.0)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes used to recompress images (default: all cores)")
+    parser.add_argument("--exact-report", action="store_true",
+                        help="Measure the PDF size without images with an extra image-free save instead of estimating it")
+    parser.add_argument("--target-size", type=target_size_spec, default=None,
+                        help="Aim for this output size, e.g. 10M, 500K or 25%% of the input. Scale/quality are searched per image, "
+                             "scale_factor becomes the largest scale allowed")
+    parser.add_argument("--skip-below", type=float, default=8,
+                        help="Leave images whose stored stream is smaller than this many KB untouched (default: 8, 0 disables)")
+    parser.add_argument("--skip-jpeg-bpp", type=float, default=1.0,
+                        help="Leave JPEGs already below this many bits per output pixel untouched (default: 1.0, 0 disables)")
+    parser.add_argument("--pages", type=page_selection, default=None,
+                        help="Only recompress images on these pages, e.g. 1-10,20,30- (default: all)")
+    parser.add_argument("--chunk", type=int, default=None, metavar="N",
+                        help="Process N pages at a time with incremental saves to bound memory on huge documents")
+    parser.add_argument("--report", default=None,
+                        help="Write per-image statistics and timings to this file, CSV if it ends in .csv, JSON otherwise")
+    parser.add_argument("--batch", action="store_true",
+                        help="Compress every PDF below a directory (or matching a glob) into the output directory, one file per worker process")
+    parser.add_argument("--journal", default=None,
+                        help="Batch journal used to resume interrupted runs (default: OUTPUT_DIR/.pdf-compress-journal.jsonl)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Keep encoded images in this directory so identical images are encoded once across files and runs")
+    parser.add_argument("--cache-size", type=int, default=256,
+                        help="In-memory image cache size in MB (default: 256)")
+    args = parser.parse_args()
+    if args.chunk is not None and args.chunk < 1:
+        print("Error: --chunk must be at least 1.")
         sys.exit(1)
-    input_pdf = sys.argv[1]
-    output_pdf = sys.argv[2]
-    scale_factor = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
-    jpeg_quality = int(100*scale_factor)
-    main(input_pdf, output_pdf, scale_factor, jpeg_quality)
+    jpeg_quality = int(100*args.scale_factor)
+    if args.batch:
+        failed = batch_compress(args.input_pdf, args.output_pdf, args.workers, args.journal, args.cache_dir, args.cache_size,
+                       scale_factor=args.scale_factor, jpeg_quality=jpeg_quality, target_size=args.target_size,
+                       skip_below=int(args.skip_below * 1024), skip_jpeg_bpp=args.skip_jpeg_bpp,
+                       pages=args.pages, chunk_pages=args.chunk)
+        sys.exit(1 if failed else 0)
+    main(args.input_pdf, args.output_pdf, args.scale_factor, jpeg_quality, args.workers, args.exact_report,
+         args.cache_dir, args.cache_size, args.target_size, int(args.skip_below * 1024), args.skip_jpeg_bpp,
+         args.pages, args.chunk, args.report)
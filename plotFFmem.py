@@ -2,110 +2,395 @@ import gzip
 import json
 import argparse
 import sys
+import time
+import operator
+from collections import Counter
+from itertools import accumulate, islice, repeat
+from array import array
 import plotly.express as px
 
-def load_flat_reports(filename):
-	# Open the gzipped file in binary read mode
-	with gzip.open(filename, 'rb') as f:
-		# Read the content as bytes
-		gzipped_content = f.read()
-		# Decode the bytes to a string, using 'utf-8' and 'ignore' errors
-		# 'ignore' will skip characters that cannot be decoded,
-		# which might be acceptable for some corrupted parts or non-standard characters.
-		# If strict adherence to valid UTF-8 is required, 'replace' or 'backslashreplace'
-		# could also be considered, or raising an error for invalid characters.
-		decoded_content = gzipped_content.decode('utf-8', errors='ignore')
-		# Load the JSON from the decoded string
-		return json.loads(decoded_content)
+READ_CHUNK = 1 << 20
+
+def iter_flat_reports(filename):
+	# Yields the entries of the top-level "reports" array one at a time, straight from the
+	# gzip stream, so neither the whole file nor the whole object graph is ever in memory.
+	# A small event-style reader on top of json.JSONDecoder.raw_decode: it walks the
+	# top-level object key by key and decodes the report objects individually.
+	# Like before, bytes that aren't valid UTF-8 are dropped ('ignore').
+	decoder = json.JSONDecoder()
+	with gzip.open(filename, 'rt', encoding='utf-8', errors='ignore') as f:
+		buf = ''
+		pos = 0
+		eof = False
+
+		def fill():
+			# Drop what has been consumed and append the next chunk, False at end of file
+			nonlocal buf, pos, eof
+			chunk = f.read(READ_CHUNK)
+			buf = buf[pos:] + chunk
+			pos = 0
+			eof = not chunk
+			return not eof
+
+		def skip_ws():
+			nonlocal pos
+			while True:
+				while pos < len(buf) and buf[pos] in ' \t\r\n':
+					pos += 1
+				if pos < len(buf) or not fill():
+					return
+
+		def expect(chars):
+			nonlocal pos
+			skip_ws()
+			if pos >= len(buf) or buf[pos] not in chars:
+				found = buf[pos] if pos < len(buf) else 'end of file'
+				raise ValueError(f"Malformed memory report: expected {chars!r}, found {found!r}")
+			pos += 1
+			return buf[pos - 1]
+
+		def value():
+			# One complete JSON value, reading more until it decodes
+			nonlocal pos
+			skip_ws()
+			while True:
+				try:
+					result, end = decoder.raw_decode(buf, pos)
+				except json.JSONDecodeError:
+					if not fill():
+						raise
+					continue
+				# A number cut off by the end of the buffer may continue in the next chunk
+				if (isinstance(result, (int, float)) and not eof
+						and (end == len(buf) or buf[end] in '0123456789.eE+-') and fill()):
+					continue
+				pos = end
+				return result
+
+		expect('{')
+		skip_ws()
+		if buf[pos:pos + 1] == '}':
+			return
+		while True:
+			key = value()
+			expect(':')
+			if key != 'reports':
+				value()
+			else:
+				expect('[')
+				skip_ws()
+				if buf[pos:pos + 1] == ']':
+					pos += 1
+				else:
+					while True:
+						yield value()
+						if expect(',]') == ']':
+							break
+			if expect(',}') == '}':
+				return
 
 def bytes_to_mb(num_bytes):
 	return num_bytes / 1048576
 
-def insert_path(tree, path_parts, amount):
-	node = tree
-	for part in path_parts:
-		if part not in node['children']:
-			node['children'][part] = {'name': part, 'amount': 0, 'children': {}}
-		node = node['children'][part]
-	node['amount'] += amount
-
-def sum_amounts(node):
-	if node['children']:
-		# Ensure that 'amount' is explicitly summed from children
-		node['amount'] = sum(sum_amounts(child) for child in node['children'].values())
-	return node['amount']
-
-
-def build_explicit_tree_for_all_processes(reports):
-	processes = sorted(set(r["process"] for r in reports if r["path"] == "explicit" or r["path"].startswith("explicit/")))
-	tree = {'name': 'All Processes', 'amount': 0, 'children': {}}
-	for proc in processes:
-		proc_tree = {'name': proc, 'amount': 0, 'children': {}}
-		for r in reports:
-			if r["process"] != proc:
-				continue
-			if not (r["path"] == "explicit" or r["path"].startswith("explicit/")):
-				continue
-			path_parts = r["path"].split("/")
-			insert_path(proc_tree, path_parts, r.get("amount", 0))
-		sum_amounts(proc_tree)
-		tree['children'][proc] = proc_tree
+class ExplicitTree:
+	# Array-backed tree: node i has parent[i], name[i] (an id into names, so path
+	# components like "js-non-window" are stored once however often they repeat) and
+	# amount[i]. Node 0 is the root and every node comes after its parent.
+	def __init__(self, root_name):
+		self.names = []
+		self.name_ids = {}
+		self.child_ids = {}  # parent << 32 | name id -> child node
+		self.parent = array('i', [-1])
+		self.name = array('i', [self.intern(root_name)])
+		self.amount = array('d', [0])
+		self.first_child = None
+		self.child_list = None
+
+	def __len__(self):
+		return len(self.parent)
+
+	def copy(self):
+		# Same nodes, names and amounts, without the children lists
+		tree = ExplicitTree(self.label(0))
+		tree.names = self.names[:]
+		tree.name_ids = dict(self.name_ids)
+		tree.child_ids = dict(self.child_ids)
+		tree.parent = self.parent[:]
+		tree.name = self.name[:]
+		tree.amount = self.amount[:]
+		return tree
+
+	def intern(self, name):
+		name_id = self.name_ids.get(name)
+		if name_id is None:
+			name_id = self.name_ids[name] = len(self.names)
+			self.names.append(name)
+		return name_id
+
+	def label(self, node):
+		return self.names[self.name[node]]
+
+	def child(self, node, name_id):
+		# The child of node with the given name id, created if it doesn't exist yet
+		key = node << 32 | name_id
+		child = self.child_ids.get(key)
+		if child is None:
+			child = self.child_ids[key] = len(self.parent)
+			self.parent.append(node)
+			self.name.append(name_id)
+			self.amount.append(0)
+		return child
+
+	def insert(self, node, path_parts, amount):
+		name_ids, child_ids = self.name_ids, self.child_ids
+		for part in path_parts:
+			name_id = name_ids.get(part)
+			if name_id is None:
+				name_id = self.intern(part)
+			child = child_ids.get(node << 32 | name_id)
+			node = child if child is not None else self.child(node, name_id)
+		self.amount[node] += amount
+
+	def link(self):
+		# Children lists in CSR form, call once the tree is complete: the children of
+		# node i are child_list[first_child[i]:first_child[i + 1]], in insertion order
+		# (the sort by parent is stable).
+		parent = self.parent
+		n = len(parent)
+		self.child_list = array('i', sorted(range(1, n), key=parent.__getitem__))
+		counts = Counter(islice(parent, 1, None))
+		self.first_child = array('i', accumulate(map(counts.get, range(n), repeat(0)), initial=0))
+
+	def children(self, node):
+		return self.child_list[self.first_child[node]:self.first_child[node + 1]]
+
+	def sort_children(self, node, key):
+		start, end = self.first_child[node], self.first_child[node + 1]
+		self.child_list[start:end] = array('i', sorted(self.child_list[start:end], key=key))
+
+def sum_amounts(tree):
+	# Children always come after their parent, so sweeping the nodes in reverse is a
+	# post-order walk: a node's children are final by the time it is reached.
+	amount, parent, first = tree.amount, tree.parent, tree.first_child
+	totals = array('d', [0]) * len(tree)
+	for node in range(len(tree) - 1, -1, -1):
+		if first[node + 1] > first[node]:
+			# Ensure that 'amount' is explicitly summed from children
+			amount[node] = totals[node]
+		if node:
+			totals[parent[node]] += amount[node]
+
+
+def build_explicit_tree_for_all_processes(reports, timings=None):
+	# Single pass over the reports (which may be a stream), each one goes straight to
+	# its process subtree by dict lookup. timings, if given, gets the seconds spent
+	# building (including reading, when reports is a stream) and aggregating.
+	start = time.perf_counter()
+	tree = ExplicitTree('All Processes')
+	proc_nodes = {}
+	for r in reports:
+		path = r["path"]
+		if not (path == "explicit" or path.startswith("explicit/")):
+			continue
+		proc = r["process"]
+		proc_node = proc_nodes.get(proc)
+		if proc_node is None:
+			proc_node = proc_nodes[proc] = tree.child(0, tree.intern(proc))
+		tree.insert(proc_node, path.split("/"), r.get("amount", 0))
+	tree.link()
+	# Processes in name order, like the plot always had them
+	tree.sort_children(0, tree.label)
+	built = time.perf_counter()
 	sum_amounts(tree)
+	if timings is not None:
+		timings["build"] = built - start
+		timings["aggregate"] = time.perf_counter() - built
 	return tree
 
 def get_top_nodes_by_fraction(tree, fraction=0.5):
-	# tree['children'] are level-1 nodes (processes)
-	children = list(tree['children'].values())
-	children.sort(key=lambda n: n['amount'], reverse=True)
-	total = sum(child['amount'] for child in children)
+	# The root's children are level-1 nodes (processes)
+	children = sorted(tree.children(0), key=lambda n: tree.amount[n], reverse=True)
+	total = sum(tree.amount[child] for child in children)
 	running = 0
 	top_names = set()
 	for child in children:
-		running += child['amount']
-		top_names.add(child['name'])
+		running += tree.amount[child]
+		top_names.add(tree.label(child))
 		if running >= total * fraction:
 			break
 	return top_names
 
-def flatten_tree_adaptive(node, parent_path, labels, parents, values, hover_texts,
-							process_deep, base_depth, max_depth, current_depth=0, process_name=None):
-	label = node['name']
-	this_path = parent_path + "/" + label if parent_path else label
-
-	# Determine process for this node
-	# The 'All Processes' node is at depth 0, its children (the actual processes) are at depth 1.
-	# So, if parent_path is "All Processes", the current 'label' is a process name.
-	if current_depth == 1 and parent_path == "All Processes":
-		process_name = label
-	elif current_depth == 0: # For the "All Processes" root node itself
-		process_name = None # No specific process name yet
-
-	# Add node to sunburst
-	if parent_path:  # skip synthetic root ('All Processes' node itself)
-		labels.append(this_path)
+def flatten_tree_adaptive(tree, process_deep, base_depth, max_depth):
+	# Pre-order walk with an explicit stack of (node, parent id, depth, depth limit).
+	# A node's sunburst label is its full path; the parent id is the position of the
+	# parent's label in labels (-1 for the root), so each label is one concatenation.
+	# The synthetic root ('All Processes') isn't emitted itself. Processes are at
+	# depth 1: those in process_deep are unrolled to max_depth, all others (and the
+	# root) to base_depth.
+	amount, names, name = tree.amount, tree.names, tree.name
+	root_path = tree.label(0)
+	labels, parents, values = [], [], []
+	stack = []
+	if base_depth > 0:
+		stack.extend((child, -1, 1, None) for child in reversed(tree.children(0)))
+	while stack:
+		node, parent_id, depth, depth_limit = stack.pop()
+		parent_path = labels[parent_id] if parent_id >= 0 else root_path
+		label = names[name[node]]
+		labels.append(parent_path + "/" + label)
 		parents.append(parent_path)
-		values.append(bytes_to_mb(node['amount']))
-		hover_texts.append(f"{this_path}<br>{bytes_to_mb(node['amount']):,.2f} MB")
-
-	# Determine depth limit for this process
-	# If process_name is None, it means we are at the "All Processes" root or an intermediate
-	# node before a process is identified. In such cases, we should use max_depth to ensure
-	# that the process nodes themselves are always explored, and then the depth limit
-	# will apply to their children.
-	if process_name and process_name in process_deep:
-		depth_limit = max_depth
-	else:
-		depth_limit = base_depth
-
-	# Only recurse if current depth is less than the determined depth limit
-	# The current_depth here refers to the depth *of the children* if we were to recurse.
-	# So, if current_depth is already at depth_limit, we should not recurse further.
-	if current_depth < depth_limit:
-		for child in node['children'].values():
-			flatten_tree_adaptive(child, this_path, labels, parents, values, hover_texts,
-								  process_deep, base_depth, max_depth, current_depth + 1, process_name)
+		values.append(bytes_to_mb(amount[node]))
+		if depth == 1:
+			depth_limit = max_depth if label in process_deep else base_depth
+		if depth < depth_limit:
+			node_id = len(labels) - 1
+			stack.extend((child, node_id, depth + 1, depth_limit) for child in reversed(tree.children(node)))
+	# Hover text only for the nodes that made it into the plot
+	hover_texts = [f"{label}<br>{value:,.2f} MB" for label, value in zip(labels, values)]
+	return labels, parents, values, hover_texts
 
 
+def diff_trees(before, after):
+	# Merges two aggregated trees into one whose amounts are the change from before to
+	# after, node by node; nodes match by name under matching parents. The diff starts
+	# as a copy of before, and as every node comes after its parent, one forward sweep
+	# maps all of after's nodes into it. Returns the diff tree and the before and after
+	# amounts for each of its nodes.
+	diff = before.copy()
+	name_map = [diff.intern(name) for name in after.names]
+	child_ids = diff.child_ids
+	parent, name = after.parent, after.name
+	mapped = array('i', [0]) * len(after)
+	for node in range(1, len(after)):
+		mapped_parent, name_id = mapped[parent[node]], name_map[name[node]]
+		child = child_ids.get(mapped_parent << 32 | name_id)
+		mapped[node] = child if child is not None else diff.child(mapped_parent, name_id)
+	before_amount = before.amount + array('d', [0]) * (len(diff) - len(before))
+	after_amount = array('d', [0]) * len(diff)
+	for node, amount in enumerate(after.amount):
+		after_amount[mapped[node]] = amount
+	diff.amount = array('d', map(operator.sub, after_amount, before_amount))
+	diff.link()
+	diff.sort_children(0, diff.label)
+	return diff, before_amount, after_amount
+
+def flatten_diff(diff, before_amount, after_amount, threshold, max_depth):
+	# The nodes down to max_depth whose change is more than threshold bytes either way,
+	# plus their ancestors so the sunburst stays connected. Parents are emitted before
+	# their children, labels are full paths like in flatten_tree_adaptive.
+	amount, parent, names, name = diff.amount, diff.parent, diff.names, diff.name
+	n = len(diff)
+	depth = array('i', [0]) * n
+	for node in range(1, n):
+		depth[node] = depth[parent[node]] + 1
+	keep = bytearray(n)
+	for node in range(n - 1, 0, -1):
+		if depth[node] <= max_depth and (keep[node] or abs(amount[node]) > threshold):
+			keep[node] = keep[parent[node]] = 1
+	root_path = diff.label(0)
+	position = array('i', [-1]) * n
+	labels, parents, deltas, befores, afters = [], [], [], [], []
+	for node in range(1, n):
+		if not keep[node]:
+			continue
+		parent_path = labels[position[parent[node]]] if parent[node] else root_path
+		position[node] = len(labels)
+		labels.append(parent_path + "/" + names[name[node]])
+		parents.append(parent_path)
+		deltas.append(bytes_to_mb(amount[node]))
+		befores.append(bytes_to_mb(before_amount[node]))
+		afters.append(bytes_to_mb(after_amount[node]))
+	return labels, parents, deltas, befores, afters
+
+def print_diff_table(labels, deltas, befores, afters, threshold_mb):
+	# Largest changes first, ancestors that are only there for the sunburst are left out
+	rows = [row for row in zip(deltas, befores, afters, labels) if abs(row[0]) > threshold_mb]
+	rows.sort(key=lambda row: abs(row[0]), reverse=True)
+	print(f"{'Change MB':>12} {'Before MB':>12} {'After MB':>12}  Path")
+	for delta, before, after, label in rows:
+		print(f"{delta:+12,.2f} {before:12,.2f} {after:12,.2f}  {label}")
+
+def print_timings(timings, nodes):
+	print(f"{nodes:,} nodes", file=sys.stderr)
+	for stage, seconds in timings.items():
+		print(f"{stage:>10}: {seconds:8.3f} s", file=sys.stderr)
+
+def plot_adaptive(args, timings):
+	# Reports are consumed as they are decoded, nothing but the tree is kept
+	tree = build_explicit_tree_for_all_processes(iter_flat_reports(args.filename), timings)
+	top_processes = get_top_nodes_by_fraction(tree, args.fraction)
+
+	start = time.perf_counter()
+	labels, parents, values, hover_texts = flatten_tree_adaptive(
+		tree,
+		process_deep=top_processes,
+		base_depth=args.base_depth,
+		max_depth=args.max_depth
+	)
+	timings["flatten"] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	fig = px.sunburst(
+		names=labels,
+		parents=parents,
+		values=values,
+		title=f"about:memory (All Processes, Explicit Allocations, Adaptive Depth)",
+		custom_data=[hover_texts, values]
+	)
+	fig.update_traces(
+		hovertemplate='<b>%{customdata[0]}</b><br>RAM Usage: %{customdata[1]:,.2f} MB<extra></extra>',
+		insidetextorientation='radial'
+	)
+	timings["plot"] = time.perf_counter() - start
+	if args.timings:
+		print_timings(timings, len(labels))
+	fig.show()
+
+def plot_diff(args, timings):
+	# Both dumps are built into trees in one pass each, the diff only looks at the trees
+	trees = []
+	for filename in (args.before, args.filename):
+		tree_timings = {}
+		trees.append(build_explicit_tree_for_all_processes(iter_flat_reports(filename), tree_timings))
+		for stage, seconds in tree_timings.items():
+			timings[stage] = timings.get(stage, 0.0) + seconds
+
+	start = time.perf_counter()
+	diff, before_amount, after_amount = diff_trees(*trees)
+	timings["diff"] = time.perf_counter() - start
+
+	start = time.perf_counter()
+	labels, parents, deltas, befores, afters = flatten_diff(
+		diff, before_amount, after_amount, args.threshold * 1048576, args.max_depth)
+	timings["flatten"] = time.perf_counter() - start
+
+	if args.table:
+		print_diff_table(labels, deltas, befores, afters, args.threshold)
+		if args.timings:
+			print_timings(timings, len(labels))
+		return
+
+	start = time.perf_counter()
+	# Sectors are sized by the size of the change and colored by its direction
+	fig = px.sunburst(
+		names=labels,
+		parents=parents,
+		values=[abs(delta) for delta in deltas],
+		color=["grew" if delta > 0 else "shrank" if delta < 0 else "unchanged" for delta in deltas],
+		color_discrete_map={"grew": "crimson", "shrank": "seagreen", "unchanged": "lightgray"},
+		title=f"about:memory diff (All Processes, Explicit Allocations, changes over {args.threshold:g} MB)",
+		custom_data=[labels, deltas, befores, afters]
+	)
+	fig.update_traces(
+		hovertemplate='<b>%{customdata[0]}</b><br>Change: %{customdata[1]:+,.2f} MB'
+					  '<br>Before: %{customdata[2]:,.2f} MB<br>After: %{customdata[3]:,.2f} MB<extra></extra>',
+		insidetextorientation='radial'
+	)
+	timings["plot"] = time.perf_counter() - start
+	if args.timings:
+		print_timings(timings, len(labels))
+	fig.show()
+
 def main():
 	parser = argparse.ArgumentParser(
 		description="Globally adaptive-depth sunburst for 'explicit' allocations in Firefox about:memory JSON.gz."
@@ -114,35 +399,20 @@ def main():
 	parser.add_argument("--base-depth", type=int, default=3, help="Depth for small processes (default: 3)")
 	parser.add_argument("--max-depth", type=int, default=6, help="Depth for large processes (default: 6)")
 	parser.add_argument("--fraction", type=float, default=0.5, help="Fraction of total to unroll deeply (default: 0.5)")
+	parser.add_argument("--timings", action="store_true", help="Print the time spent in each stage to stderr")
+	parser.add_argument("--before", metavar="FILE",
+						help="Diff mode: show what changed from this earlier dump to filename, down to --max-depth")
+	parser.add_argument("--threshold", type=float, default=1.0,
+						help="Diff mode: only show changes of more than this many MB, either way (default: 1.0)")
+	parser.add_argument("--table", action="store_true", help="Diff mode: print a table sorted by change instead of plotting")
 	args = parser.parse_args()
 
 	try:
-		data = load_flat_reports(args.filename)
-		reports = data["reports"]
-
-		tree = build_explicit_tree_for_all_processes(reports)
-		top_processes = get_top_nodes_by_fraction(tree, args.fraction)
-
-		labels, parents, values, hover_texts = [], [], [], []
-		flatten_tree_adaptive(
-			tree, "", labels, parents, values, hover_texts,
-			process_deep=top_processes,
-			base_depth=args.base_depth,
-			max_depth=args.max_depth
-		)
-
-		fig = px.sunburst(
-			names=labels,
-			parents=parents,
-			values=values,
-			title=f"about:memory (All Processes, Explicit Allocations, Adaptive Depth)",
-			custom_data=[hover_texts, values]
-		)
-		fig.update_traces(
-			hovertemplate='<b>%{customdata[0]}</b><br>RAM Usage: %{customdata[1]:,.2f} MB<extra></extra>',
-			insidetextorientation='radial'
-		)
-		fig.show()
+		timings = {}
+		if args.before:
+			plot_diff(args, timings)
+		else:
+			plot_adaptive(args, timings)
 	except Exception as e:
 		print(f"Error: {e}", file=sys.stderr)
 		sys.exit(1)